@@ -1,260 +1,470 @@
 import streamlit as st
 import re
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import numpy as np
 import pandas as pd
-from datetime import datetime
 import io # Needed for download button
 
-# --- Regular Expressions (same as before) ---
-log_line_regex = re.compile(
-    r"(\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}:\d{2}\.\d{3})\s+" # 1: Timestamp
-    r"(Debug|Service|Trade|User_action)\s+"             # 2: Level
-    r"'(\d+)':\s+"                                       # 3: Account ID
-    r"(.*)"                                              # 4: Message
+try: # Optional linear-time regex engine (pip install google-re2)
+    import re2
+except ImportError:
+    re2 = None
+
+def _compile(pattern, flags=0):
+    """
+    Compiles with RE2 when available, falling back to stdlib re.
+
+    RE2 matches in linear time with no backtracking, which pays off on the
+    long trade-event alternation. Stdlib flags are never handed to RE2
+    (its compile() wants an re2.Options, not a RegexFlag): re.ASCII is
+    simply dropped because RE2's \\d and friends are ASCII-only already,
+    and re.MULTILINE is translated to an inline (?m). Patterns RE2 cannot
+    express (e.g. the lookahead in the line pattern) silently get the
+    stdlib engine; lookarounds are screened out up front so RE2's C++
+    core does not log a parse error for them.
+    """
+    if re2 is not None and not any(tok in pattern for tok in ("(?=", "(?!", "(?<")):
+        re2_pattern = pattern if not flags & re.MULTILINE else "(?m)" + pattern
+        try:
+            return re2.compile(re2_pattern)
+        except Exception:
+            pass
+    return re.compile(pattern, flags)
+
+# --- Regular Expressions ---
+# Every log line starts with a small fixed-format prefix:
+#   "YYYY.MM.DD HH:MM:SS.mmm  Level  'AccountID':  message"
+# One MULTILINE pattern matches whole lines directly out of the buffer, so
+# finditer skips the dominant Debug noise at C speed instead of the parser
+# looping over a materialized list of lines. Debug is deliberately absent
+# from the level alternation, and the leading lookahead peeks at the level
+# column (the timestamp is always 23 chars wide) so Debug lines are
+# rejected on their first level byte instead of after a full timestamp
+# match.
+rgx_log_line = _compile(
+    r"^(?=[^\n]{23}[ \t]+[TUS])"
+    r"(?P<ts>\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}:\d{2}\.\d{3})[ \t]+"
+    r"(?P<lvl>Trade|User_action|Service)[ \t]+"
+    r"'(?P<acct>\d+)':[ \t]+"
+    r"(?P<msg>[^\r\n]*)\r?$",
+    re.MULTILINE | re.ASCII,
 )
-rgx_modify = re.compile(r"modify event #(\d+) (buy|sell) (limit|stop)? ([\d.]+) lots (\S+) at ([\d.]+) tp: ([\d.]+) sl: ([\d.]+)")
-rgx_open = re.compile(r"open event #(\d+) (buy|sell) ([\d.]+) lots (\S+) at ([\d.]+)")
-rgx_close = re.compile(r"close event #(\d+) (buy|sell) ([\d.]+) lots (\S+) at ([\d.]+) by (\S+)")
-rgx_balance_upd = re.compile(r"upd account info balance ([\d.]+)")
-rgx_balance_init = re.compile(r"account balance ([\d.]+) USD")
-rgx_delete_req = re.compile(r"request delete #(\d+) (.*)")
-rgx_delete_ok = re.compile(r"success delete #(\d+) (.*)")
-rgx_close_all_req = re.compile(r"request close all orders positions")
-rgx_close_all_ok = re.compile(r"success close #(\d+) (.*) at ([\d.]+)")
-rgx_close_all_summary = re.compile(r"close (\d+) from (\d+) {.*}")
-
-# --- Modified Parsing Function (takes content string) ---
-
-def generate_trading_journal_from_content(log_content_string):
+# The four Trade event shapes are merged into a single alternation so each
+# message is matched in one pass; SRE's literal-prefix fast path picks the
+# branch instead of four separate match attempts failing in turn. Which
+# branch fired is determined by its id group (exactly one is non-None).
+rgx_trade_event = _compile(
+    r"modify event #(?P<mod_id>\d+) (?P<mod_dir>buy|sell) (?P<mod_type>limit|stop)? (?P<mod_vol>\d+(?:\.\d+)?) lots (?P<mod_inst>\S+) at (?P<mod_price>\d+(?:\.\d+)?) tp: (?P<mod_tp>\d+(?:\.\d+)?) sl: (?P<mod_sl>\d+(?:\.\d+)?)"
+    r"|open event #(?P<open_id>\d+) (?P<open_dir>buy|sell) (?P<open_vol>\d+(?:\.\d+)?) lots (?P<open_inst>\S+) at (?P<open_price>\d+(?:\.\d+)?)"
+    r"|close event #(?P<close_id>\d+) (?P<close_dir>buy|sell) (?P<close_vol>\d+(?:\.\d+)?) lots (?P<close_inst>\S+) at (?P<close_price>\d+(?:\.\d+)?) by (?P<close_by>\S+)"
+    r"|success close #(?P<ok_id>\d+) (?P<ok_details>.*) at (?P<ok_price>\d+(?:\.\d+)?)",
+    re.ASCII,
+)
+rgx_balance_upd = _compile(r"upd account info balance (\d+(?:\.\d+)?)", re.ASCII)
+rgx_balance_init = _compile(r"account balance (\d+(?:\.\d+)?) USD", re.ASCII)
+rgx_delete_req = _compile(r"request delete #(\d+) (.*)", re.ASCII)
+rgx_delete_ok = _compile(r"success delete #(\d+) (.*)", re.ASCII)
+rgx_close_all_req = _compile(r"request close all orders positions", re.ASCII)
+rgx_close_all_summary = _compile(r"close (\d+) from (\d+) {.*}", re.ASCII)
+
+# Standard journal column order. Timestamps stay as strings on purpose: the
+# "YYYY.MM.DD HH:MM:SS.mmm" format sorts lexicographically in time order, so
+# there is no need for a (slow) pd.to_datetime pass over the column.
+JOURNAL_COLS = ("Timestamp", "Order/Pos ID", "Action", "Direction", "Type",
+                "Instrument", "Volume", "Price", "TP", "SL", "Notes",
+                "Balance After Close", "P/L ($)")
+NUM_COLS = frozenset({"Order/Pos ID", "Volume", "Price", "TP", "SL",
+                      "Balance After Close", "P/L ($)"})
+
+# Missing-value sentinel for the numeric columns. Always this exact object,
+# so "is _NAN" distinguishes a not-yet-filled cell from a computed value.
+_NAN = float("nan")
+
+def _parse_fixed2(s):
+    """
+    Parses a fixed-2-decimal monetary string (e.g. "10049.50") into int cents.
+
+    Balance bookkeeping in integer cents keeps the P/L subtraction exact, so
+    no float rounding is needed before values are stored in the journal.
+    """
+    dot = s.find(".")
+    if dot == -1:
+        return int(s) * 100
+    whole = int(s[:dot]) * 100
+    frac = s[dot + 1:dot + 3]
+    if len(frac) == 1:
+        return whole + int(frac) * 10
+    return whole + int(frac)
+
+# --- Modified Parsing Function (takes string or text stream) ---
+
+_STREAM_CHUNK_SIZE = 1 << 20 # 1 MiB of text per read
+
+def _iter_log_chunks(log_source):
+    """
+    Yields newline-aligned text chunks from a string or a text stream.
+
+    Streaming in large chunks keeps peak memory at one chunk instead of the
+    whole decoded file, while still giving finditer big spans to scan. A
+    partial trailing line is carried over into the next chunk.
+    """
+    if isinstance(log_source, str):
+        yield log_source
+        return
+    carry = ""
+    while True:
+        block = log_source.read(_STREAM_CHUNK_SIZE)
+        if not block:
+            if carry:
+                yield carry
+            return
+        if carry:
+            block = carry + block
+        cut = block.rfind("\n")
+        if cut == -1:
+            carry = block
+            continue
+        carry = block[cut + 1:]
+        yield block[:cut + 1]
+
+def _tokenize_chunk(chunk):
+    """
+    Tokenizes one newline-aligned chunk of log text into typed event tuples.
+
+    This stage is pure - regex matching and scalar conversion only, with no
+    journal state and no Streamlit calls - so it stands alone from the
+    stateful journal assembly in generate_trading_journal_from_content.
+    Each tuple is an event kind tag followed by (timestamp, account) and
+    the kind-specific parsed fields.
+    """
+    events = []
+    emit = events.append
+    # Bind the hot pattern methods to locals once; each call in the loop is
+    # then a LOAD_FAST instead of an attribute lookup on the pattern object.
+    balance_upd_search = rgx_balance_upd.search
+    balance_init_search = rgx_balance_init.search
+    trade_event_match = rgx_trade_event.match
+    delete_req_match = rgx_delete_req.match
+    delete_ok_match = rgx_delete_ok.match
+    close_all_req_match = rgx_close_all_req.match
+
+    for m_line in rgx_log_line.finditer(chunk):
+        timestamp_str, level, acct, message = m_line.group(
+            "ts", "lvl", "acct", "msg")
+
+        if level == "Trade":
+            m_bal = balance_upd_search(message)
+            if m_bal:
+                # Balances are fixed-2-decimal; keep them as exact int cents
+                emit(("bal_upd", timestamp_str, acct, _parse_fixed2(m_bal.group(1))))
+                continue
+            m_event = trade_event_match(message)
+            if m_event is None:
+                continue
+            if m_event["mod_id"] is not None:
+                order_id, direction, type_suffix, instrument = m_event.group(
+                    "mod_id", "mod_dir", "mod_type", "mod_inst")
+                # One C-level map call converts all numeric groups at once
+                volume, price, tp, sl = map(float, m_event.group(
+                    "mod_vol", "mod_price", "mod_tp", "mod_sl"))
+                emit(("mod", timestamp_str, acct, int(order_id),
+                      direction.capitalize(),
+                      (type_suffix if type_suffix else "Limit/Stop").capitalize(),
+                      instrument, volume, price, tp, sl))
+            elif m_event["open_id"] is not None:
+                order_id, direction, instrument = m_event.group(
+                    "open_id", "open_dir", "open_inst")
+                volume, price = map(float, m_event.group("open_vol", "open_price"))
+                emit(("open", timestamp_str, acct, int(order_id),
+                      direction.capitalize(), instrument, volume, price))
+            elif m_event["close_id"] is not None:
+                order_id, direction, instrument, closed_by = m_event.group(
+                    "close_id", "close_dir", "close_inst", "close_by")
+                volume, price = map(float, m_event.group("close_vol", "close_price"))
+                emit(("close", timestamp_str, acct, int(order_id),
+                      direction.capitalize(), instrument, volume, price,
+                      closed_by))
+            else:
+                order_id, close_price = m_event.group("ok_id", "ok_price")
+                emit(("close_ok", timestamp_str, acct, int(order_id), close_price))
+
+        elif level == "User_action":
+            m_del_req = delete_req_match(message)
+            if m_del_req:
+                order_id, details = m_del_req.groups()
+                emit(("del_req", timestamp_str, acct, int(order_id), details))
+                continue
+            m_del_ok = delete_ok_match(message)
+            if m_del_ok:
+                order_id, details = m_del_ok.groups()
+                emit(("del_ok", timestamp_str, acct, int(order_id), details))
+                continue
+            if close_all_req_match(message):
+                emit(("close_all_req", timestamp_str, acct))
+
+        else: # Service
+            m_bal = balance_init_search(message)
+            if m_bal:
+                emit(("bal_init", timestamp_str, acct, _parse_fixed2(m_bal.group(1))))
+
+    return events
+
+def _iter_events(log_source):
+    """
+    Yields event tuples for the log, tokenizing chunks in parallel when the
+    input spans several chunks.
+
+    _tokenize_chunk is pure and chunk-independent, so chunks can be farmed
+    to worker processes while the stateful reduction stays sequential.
+    Workers use the fork start method (no re-import of this Streamlit
+    script); where fork is unavailable, or for logs that fit in one chunk,
+    tokenization runs inline since pool startup would outweigh the win.
+    A bounded in-flight window keeps memory at a few chunks.
     """
-    Parses trading log content (string) and generates a trading journal DataFrame.
+    chunks = _iter_log_chunks(log_source)
+    workers = os.cpu_count() or 1
+
+    # Peek ahead: a single-chunk log (the common case, anything under
+    # _STREAM_CHUNK_SIZE) is not worth a process pool.
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None:
+        yield from _tokenize_chunk(first)
+        return
+
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            in_flight = deque()
+            for chunk in chain((first, second), chunks):
+                in_flight.append(pool.submit(_tokenize_chunk, chunk))
+                if len(in_flight) > workers + 1:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+    else:
+        for chunk in chain((first, second), chunks):
+            yield from _tokenize_chunk(chunk)
+
+def generate_trading_journal_from_content(log_source):
+    """
+    Parses trading log content and generates a trading journal DataFrame.
 
     Args:
-        log_content_string (str): The entire content of the log file as a string.
+        log_source (str | io.TextIOBase): The log content, either as a whole
+            string or as a UTF-8 text stream to be read incrementally.
 
     Returns:
         pd.DataFrame: A Pandas DataFrame representing the trading journal.
                       Returns an empty DataFrame if parsing fails or no data found.
     """
-    journal = []
-    open_positions = {}
-    pending_orders = {}
+    # The journal is accumulated column-wise (one list per column) rather
+    # than as a list of per-row dicts, so DataFrame construction at the end
+    # is a straight column hand-off with no row-to-column transpose.
+    cols_data = {col: [] for col in JOURNAL_COLS}
+    # Aliases for the columns the loop reads back or patches by index.
+    id_col = cols_data["Order/Pos ID"]
+    action_col = cols_data["Action"]
+    tp_col = cols_data["TP"]
+    sl_col = cols_data["SL"]
+    notes_col = cols_data["Notes"]
+    balance_col = cols_data["Balance After Close"]
+    pl_col = cols_data["P/L ($)"]
+
+    col_lists = tuple(cols_data[col] for col in JOURNAL_COLS)
+
+    def append_row(row):
+        """
+        Appends one 13-tuple in JOURNAL_COLS order across the column lists
+        (Timestamp, Order/Pos ID, Action, Direction, Type, Instrument,
+        Volume, Price, TP, SL, Notes, Balance After Close, P/L ($));
+        returns the new row index.
+        """
+        for col, val in zip(col_lists, row):
+            col.append(val)
+        return len(action_col) - 1
+
+    open_positions = set() # order/pos ids currently open
+    pending_orders = {}    # order id -> (tp, sl) from the Place/Mod
+    close_entry_index = {} # order id -> journal row index of the last Close
     last_known_balance = None
-    closed_order_ids_pending_pl = []
+    # FIFO of (order id, journal row index) for Close rows awaiting P/L;
+    # O(1) popleft replaces a backwards scan through the whole journal.
+    closed_order_ids_pending_pl = deque()
     account_id = "N/A" # Default account ID
+    # P/L anomaly messages are collected here and emitted after parsing;
+    # Streamlit round-trips inside the loop would slow down the hot path.
+    warnings = []
+    infos = []
 
     try:
-        log_lines = log_content_string.splitlines()
-
-        for line_num, line in enumerate(log_lines):
-            match = log_line_regex.match(line.strip())
-            if not match:
-                continue
-
-            timestamp_str, level, current_account_id, message = match.groups()
+        # The pure tokenizer stage turns chunks into typed event tuples
+        # (in parallel for multi-chunk logs); this loop only maintains
+        # journal state.
+        for event in _iter_events(log_source):
+            kind, timestamp_str, acct = event[0], event[1], event[2]
             if account_id == "N/A": # Capture first account ID found
-                 account_id = current_account_id
-
-            entry = {
-                "Timestamp": timestamp_str,
-                "Order/Pos ID": None,
-                "Action": None,
-                "Direction": None,
-                "Type": None,
-                "Instrument": None,
-                "Volume": None,
-                "Price": None,
-                "TP": None,
-                "SL": None,
-                "Notes": "",
-                "Balance After Close": None,
-                "P/L ($)": None
-            }
-            processed = False
-
-            # --- Balance Updates ---
-            if level == "Service":
-                m_bal_init = rgx_balance_init.search(message)
-                if m_bal_init:
-                    balance = float(m_bal_init.group(1))
-                    if last_known_balance is None:
-                        last_known_balance = balance
-                        # Optionally add a marker for initial balance if desired
-                        # entry["Action"] = "Balance Found"
-                        # entry["Price"] = balance
-                        # journal.append(entry)
-                    processed = True
-
-            elif level == "Trade":
-                m_bal_upd = rgx_balance_upd.search(message)
-                if m_bal_upd:
-                    current_balance = float(m_bal_upd.group(1))
-                    pl_attributed_in_this_update = False
-
-                    if last_known_balance is not None and closed_order_ids_pending_pl:
-                        # Iterate through *pending* P/L assignments
-                        temp_closed_ids = list(closed_order_ids_pending_pl) # Copy to iterate while modifying original
-                        for closed_id in temp_closed_ids:
-                            # Find the journal entry for this closed order
-                            for i in range(len(journal) - 1, -1, -1):
-                                if journal[i]["Order/Pos ID"] == closed_id and journal[i]["Action"] == "Close" and journal[i]["P/L ($)"] is None:
-                                    # Assign P/L based on this specific balance update
-                                    trade_pl = current_balance - last_known_balance
-                                    journal[i]["Balance After Close"] = current_balance
-                                    journal[i]["P/L ($)"] = round(trade_pl, 2)
-                                    closed_order_ids_pending_pl.remove(closed_id)
-                                    last_known_balance = current_balance # Update balance *after* assigning P/L for this specific close
-                                    pl_attributed_in_this_update = True
-                                    break # Found and updated the specific close entry
-                            if pl_attributed_in_this_update:
-                                break # Process only one P/L per balance update for simpler logic
-
-                        # If balance changed but we couldn't attribute it (e.g., multiple closes then one update)
-                        if not pl_attributed_in_this_update and closed_order_ids_pending_pl and current_balance != last_known_balance:
-                            pl_total = current_balance - last_known_balance
-                            st.warning(f"Balance changed by {round(pl_total, 2)} at {timestamp_str}, but could not attribute P/L directly to a single recent close event (IDs: {closed_order_ids_pending_pl}). Manual review might be needed for precise P/L split.")
-                            # Clear the queue as we can't accurately assign the P/L split anymore with this simple logic
-                            closed_order_ids_pending_pl.clear()
-                            last_known_balance = current_balance
-
-                    elif last_known_balance is not None and current_balance != last_known_balance and not closed_order_ids_pending_pl:
-                         # Balance changed without a recent known close event
-                         pl_total = current_balance - last_known_balance
-                         st.info(f"Balance changed by {round(pl_total, 2)} at {timestamp_str} without a directly preceding logged close event (potentially occurred during connection gap or external action).")
-                         last_known_balance = current_balance
-
-                    elif last_known_balance is None: # Set initial balance if first seen here
-                         last_known_balance = current_balance
-
-                    # Always update the latest known balance for future calcs
-                    last_known_balance = current_balance
-                    processed = True
-
+                 account_id = acct
 
             # --- Trade Actions ---
-            if level == "Trade" and not processed:
-                m_mod = rgx_modify.match(message)
-                m_open = rgx_open.match(message)
-                m_close = rgx_close.match(message)
-                m_close_all_ok = rgx_close_all_ok.match(message)
-
-                if m_mod:
-                    order_id, direction, type_suffix, volume, instrument, price, tp, sl = m_mod.groups()
-                    entry["Order/Pos ID"] = int(order_id)
-                    entry["Action"] = "Place/Mod"
-                    entry["Direction"] = direction.capitalize()
-                    entry["Type"] = (type_suffix if type_suffix else "Limit/Stop").capitalize()
-                    entry["Instrument"] = instrument
-                    entry["Volume"] = float(volume)
-                    entry["Price"] = float(price)
-                    entry["TP"] = float(tp)
-                    entry["SL"] = float(sl)
-                    pending_orders[entry["Order/Pos ID"]] = entry
-                    journal.append(entry)
-
-                elif m_open:
-                    order_id, direction, volume, instrument, price = m_open.groups()
-                    entry["Order/Pos ID"] = int(order_id)
-                    entry["Action"] = "Open"
-                    entry["Direction"] = direction.capitalize()
-                    entry["Type"] = "Limit Hit?"
-                    if entry["Order/Pos ID"] in pending_orders:
-                        entry["Type"] = "Limit Hit"
-                        entry["TP"] = pending_orders[entry["Order/Pos ID"]].get("TP")
-                        entry["SL"] = pending_orders[entry["Order/Pos ID"]].get("SL")
-                        del pending_orders[entry["Order/Pos ID"]]
-                    else:
-                        entry["Type"] = "Market?/Gap?"
-                    entry["Instrument"] = instrument
-                    entry["Volume"] = float(volume)
-                    entry["Price"] = float(price)
-                    open_positions[entry["Order/Pos ID"]] = entry
-                    journal.append(entry)
-
-                elif m_close:
-                    order_id, direction, volume, instrument, price, closed_by = m_close.groups()
-                    entry["Order/Pos ID"] = int(order_id)
-                    entry["Action"] = "Close"
-                    entry["Direction"] = direction.capitalize()
-                    entry["Price"] = float(price) # Entry price recorded in log
-                    entry["Instrument"] = instrument
-                    entry["Volume"] = float(volume)
-                    entry["Notes"] = f"Closed by {closed_by}"
-                    if entry["Order/Pos ID"] in open_positions:
-                        del open_positions[entry["Order/Pos ID"]]
-                    closed_order_ids_pending_pl.append(entry["Order/Pos ID"]) # Mark for P/L calc
-                    journal.append(entry)
-
-                elif m_close_all_ok:
-                     order_id, details, close_price = m_close_all_ok.groups()
-                     entry["Order/Pos ID"] = int(order_id)
-                     entry["Action"] = "Close OK"
-                     entry["Notes"] = f"Part of Close All. Confirmed @ {close_price}"
-                     # Update note if Close event already exists
-                     found = False
-                     for i in range(len(journal) - 1, -1, -1):
-                         if journal[i]["Order/Pos ID"] == entry["Order/Pos ID"] and journal[i]["Action"] == "Close":
-                             journal[i]["Notes"] += f". Close OK @ {close_price}"
-                             found = True
-                             break
-                     if not found: journal.append(entry)
+            if kind == "mod":
+                oid, direction, order_type, instrument, volume, price, tp, sl = event[3:]
+                append_row((timestamp_str, oid, "Place/Mod", direction,
+                            order_type, instrument, volume, price, tp, sl,
+                            "", _NAN, _NAN))
+                pending_orders[oid] = (tp, sl)
+
+            elif kind == "open":
+                oid, direction, instrument, volume, price = event[3:]
+                pending = pending_orders.pop(oid, None)
+                if pending is not None:
+                    order_type = "Limit Hit"
+                    tp, sl = pending
+                else:
+                    order_type = "Market?/Gap?"
+                    tp = sl = _NAN
+                append_row((timestamp_str, oid, "Open", direction,
+                            order_type, instrument, volume, price, tp, sl,
+                            "", _NAN, _NAN))
+                open_positions.add(oid)
+
+            elif kind == "close":
+                oid, direction, instrument, volume, price, closed_by = event[3:]
+                # Price here is the entry price recorded in the log
+                idx = append_row((timestamp_str, oid, "Close", direction,
+                                  None, instrument, volume, price, _NAN, _NAN,
+                                  f"Closed by {closed_by}", _NAN, _NAN))
+                open_positions.discard(oid)
+                close_entry_index[oid] = idx
+                closed_order_ids_pending_pl.append((oid, idx)) # Mark for P/L calc
+
+            elif kind == "close_ok":
+                oid, close_price = event[3:]
+                # Update note if Close event already exists
+                close_idx = close_entry_index.get(oid)
+                if close_idx is not None:
+                    notes_col[close_idx] += f". Close OK @ {close_price}"
+                else:
+                    append_row((timestamp_str, oid, "Close OK", None, None,
+                                None, _NAN, _NAN, _NAN, _NAN,
+                                f"Part of Close All. Confirmed @ {close_price}",
+                                _NAN, _NAN))
 
-            # --- User Actions ---
-            elif level == "User_action" and not processed:
-                m_del_req = rgx_delete_req.match(message)
-                m_del_ok = rgx_delete_ok.match(message)
-                m_close_all_req = rgx_close_all_req.match(message)
-
-                if m_del_req:
-                    order_id, details = m_del_req.groups()
-                    entry["Order/Pos ID"] = int(order_id)
-                    entry["Action"] = "Delete Req"
-                    entry["Notes"] = f"User: {details}"
-                    journal.append(entry)
-                elif m_del_ok:
-                    order_id, details = m_del_ok.groups()
-                    entry["Order/Pos ID"] = int(order_id)
-                    entry["Action"] = "Delete OK"
-                    entry["Notes"] = f"Success: {details}"
-                    if entry["Order/Pos ID"] in pending_orders:
-                         del pending_orders[entry["Order/Pos ID"]]
-                    journal.append(entry)
-                elif m_close_all_req:
-                    entry["Action"] = "Close All Req"
-                    entry["Notes"] = "User requested close all"
-                    journal.append(entry)
+            # --- Balance Updates ---
+            elif kind == "bal_upd":
+                current_balance = event[3]
+                pl_attributed_in_this_update = False
+
+                if last_known_balance is not None and closed_order_ids_pending_pl:
+                    # Attribute this update to the oldest Close still
+                    # awaiting P/L (one P/L per balance update for
+                    # simpler logic); its row index comes straight off
+                    # the deque, no journal scan needed.
+                    closed_id, close_idx = closed_order_ids_pending_pl.popleft()
+                    if pl_col[close_idx] is _NAN:
+                        # Cents arithmetic is exact; divide once on store
+                        trade_pl = current_balance - last_known_balance
+                        balance_col[close_idx] = current_balance / 100.0
+                        pl_col[close_idx] = trade_pl / 100.0
+                        last_known_balance = current_balance # Update balance *after* assigning P/L for this specific close
+                        pl_attributed_in_this_update = True
+
+                    # If balance changed but we couldn't attribute it (e.g., multiple closes then one update)
+                    if not pl_attributed_in_this_update and current_balance != last_known_balance:
+                        pl_total = (current_balance - last_known_balance) / 100.0
+                        pending_ids = [closed_id] + [cid for cid, _ in closed_order_ids_pending_pl]
+                        warnings.append(f"Balance changed by {pl_total} at {timestamp_str}, but could not attribute P/L directly to a single recent close event (IDs: {pending_ids}). Manual review might be needed for precise P/L split.")
+                        # Clear the queue as we can't accurately assign the P/L split anymore with this simple logic
+                        closed_order_ids_pending_pl.clear()
+                        last_known_balance = current_balance
+
+                elif last_known_balance is not None and current_balance != last_known_balance and not closed_order_ids_pending_pl:
+                     # Balance changed without a recent known close event
+                     pl_total = (current_balance - last_known_balance) / 100.0
+                     infos.append(f"Balance changed by {pl_total} at {timestamp_str} without a directly preceding logged close event (potentially occurred during connection gap or external action).")
+                     last_known_balance = current_balance
+
+                elif last_known_balance is None: # Set initial balance if first seen here
+                     last_known_balance = current_balance
+
+                # Always update the latest known balance for future calcs
+                last_known_balance = current_balance
 
+            # --- User Actions ---
+            elif kind == "del_req":
+                oid, details = event[3:]
+                append_row((timestamp_str, oid, "Delete Req", None, None,
+                            None, _NAN, _NAN, _NAN, _NAN,
+                            f"User: {details}", _NAN, _NAN))
+
+            elif kind == "del_ok":
+                oid, details = event[3:]
+                append_row((timestamp_str, oid, "Delete OK", None, None,
+                            None, _NAN, _NAN, _NAN, _NAN,
+                            f"Success: {details}", _NAN, _NAN))
+                pending_orders.pop(oid, None)
+
+            elif kind == "close_all_req":
+                append_row((timestamp_str, _NAN, "Close All Req", None, None,
+                            None, _NAN, _NAN, _NAN, _NAN,
+                            "User requested close all", _NAN, _NAN))
+
+            else: # bal_init
+                if last_known_balance is None:
+                    last_known_balance = event[3]
+                    # Optionally append a marker row for the initial
+                    # balance here if desired
 
+    except UnicodeDecodeError:
+        raise # Decoding now happens during streaming; let the upload handler report it
     except Exception as e:
         st.error(f"An error occurred during log processing: {e}")
         return pd.DataFrame() # Return empty DataFrame on error
 
+    # Flush deferred messages in one batch now that parsing is done
+    for msg in warnings:
+        st.warning(msg)
+    for msg in infos:
+        st.info(msg)
+
     # --- Convert to DataFrame and Finalize ---
-    if not journal:
+    if not action_col:
         return pd.DataFrame() # Return empty if no relevant entries found
 
-    df = pd.DataFrame(journal)
-
-    # Define standard column order
-    cols = ["Timestamp", "Order/Pos ID", "Action", "Direction", "Type",
-            "Instrument", "Volume", "Price", "TP", "SL", "Notes",
-            "Balance After Close", "P/L ($)"]
-    # Add missing columns if they weren't created
-    for col in cols:
-        if col not in df.columns:
-            df[col] = None # Use None for missing values
-    df = df[cols] # Reorder
-
-    # Convert relevant columns to numeric, coercing errors
-    num_cols = ["Order/Pos ID", "Volume", "Price", "TP", "SL", "Balance After Close", "P/L ($)"]
-    for col in num_cols:
-         if col in df.columns:
-             df[col] = pd.to_numeric(df[col], errors='coerce') # Coerce turns errors into NaT/NaN
+    # Columns are already complete and in display order, and every column is
+    # handed to pandas pre-typed: float64 arrays for the numeric columns
+    # (native floats with NaN for missing throughout, so no pd.to_numeric
+    # re-parse) and explicit object arrays for the text columns, leaving the
+    # DataFrame constructor no dtype inference to do.
+    n_rows = len(action_col)
+    data = {col: (np.fromiter(values, dtype=np.float64, count=n_rows)
+                  if col in NUM_COLS
+                  else np.array(values, dtype=object))
+            for col, values in cols_data.items()}
+    df = pd.DataFrame(data, copy=False)
 
     # Fill NaN values in display columns for better presentation (optional)
     # df.fillna('', inplace=True) # Or fill specific columns
 
     return df
 
+@st.cache_data(show_spinner=False)
+def _journal_from_upload_bytes(log_bytes):
+    """
+    Cached front end for generate_trading_journal_from_content.
+
+    st.cache_data keys on the raw upload bytes, so widget-driven reruns
+    with the same file get the DataFrame back without re-parsing the log.
+    """
+    return generate_trading_journal_from_content(
+        io.TextIOWrapper(io.BytesIO(log_bytes), encoding="utf-8", newline=""))
+
 # --- Streamlit App Interface ---
 
 st.set_page_config(layout="wide") # Use wider layout
@@ -275,13 +485,11 @@ Upload your trading log file (`.txt` format) to automatically generate a trading
 uploaded_file = st.file_uploader("Choose a trading log file (.txt)", type="txt")
 
 if uploaded_file is not None:
-    # Read content
     try:
-        log_content = uploaded_file.getvalue().decode("utf-8")
         st.info(f"Processing uploaded file: {uploaded_file.name}...")
 
-        # Generate journal
-        journal_df = generate_trading_journal_from_content(log_content)
+        # Generate journal (cached on file content, so reruns are free)
+        journal_df = _journal_from_upload_bytes(uploaded_file.getvalue())
 
         if not journal_df.empty:
             st.success("Journal generated successfully!")
@@ -291,10 +499,8 @@ if uploaded_file is not None:
             st.dataframe(journal_df)
 
             # --- Download Button ---
-            # Convert DataFrame to CSV in memory
-            csv_buffer = io.StringIO()
-            journal_df.to_csv(csv_buffer, index=False, encoding='utf-8')
-            csv_data = csv_buffer.getvalue().encode('utf-8')
+            # Convert DataFrame to CSV in memory (no intermediate StringIO copy)
+            csv_data = journal_df.to_csv(index=False).encode('utf-8')
 
             # Create filename
             base_filename = uploaded_file.name.rsplit('.', 1)[0] # Remove .txt extension